@@ -1,11 +1,20 @@
 import cv2
 import redis
-import base64
 import time
 import os
+import queue
 import threading
+import uuid
 from datetime import datetime
 
+# Optional GPU JPEG encoder (pynvjpeg); falls back to OpenCV/libjpeg on CPU
+try:
+    from nvjpeg import NvJpeg
+    nvjpeg = NvJpeg()
+except Exception:
+    nvjpeg = None
+    print("nvJPEG not available, encoding frames on CPU")
+
 # Redis connection
 redis_host = os.getenv("REDIS_HOST", "redis_server")
 r = redis.StrictRedis(host=redis_host, port=6379, db=0)
@@ -29,52 +38,182 @@ CAMERAS = [
     # Add more cameras here
 ]
 
+# Frames from all camera threads are pushed to Redis by a single encoder thread.
+# nvJPEG encodes are funnelled through it too; CPU encodes stay on the camera
+# threads, where cv2.imencode runs in parallel (it releases the GIL)
+NVJPEG_QUALITY = 75
+# CPU path: quality 80, no Huffman optimisation pass (OpenCV default is 95)
+JPEG_PARAMS = [int(cv2.IMWRITE_JPEG_QUALITY), 80, int(cv2.IMWRITE_JPEG_OPTIMIZE), 0]
+ENCODE_BATCH = int(os.getenv("ENCODE_BATCH", "8"))
+encode_queue = queue.Queue(maxsize=ENCODE_BATCH * 4)
+
+# Network sources produce frames in real time; anything else is treated as a file
+LIVE_PREFIXES = ("rtsp://", "rtmp://", "http://", "https://")
+
+# Ask FFmpeg for hardware decode (NVDEC/VAAPI/...) when built in, else CPU decode
+HW_DECODE = os.getenv("HW_DECODE", "1") == "1"
+
+def open_capture(url):
+    """Open a video source, preferring hardware-accelerated decoding."""
+    if HW_DECODE:
+        cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG, [
+            cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY
+        ])
+        if cap.isOpened():
+            return cap
+        cap.release()
+    return cv2.VideoCapture(url)
+
+# Raw frames for inference go to a tmpfs shared with the worker (empty = disabled);
+# the JPEG sent over Redis is then only needed for the archived copy
+RAW_FRAME_DIR = os.getenv("RAW_FRAME_DIR", "")
+RAW_FRAME_TTL = float(os.getenv("RAW_FRAME_TTL", "30"))  # seconds
+
+def write_raw_frame(frame):
+    """Dump the decoded frame to RAW_FRAME_DIR. Returns stream fields or {}."""
+    raw_path = os.path.join(RAW_FRAME_DIR, f"{uuid.uuid4().hex}.raw")
+    try:
+        frame.tofile(raw_path)
+    except OSError as e:
+        print(f"⚠️ Could not write raw frame {raw_path}: {e}")
+        return {}
+    return {
+        "raw_path": raw_path,
+        "raw_shape": ",".join(map(str, frame.shape)),
+        "raw_dtype": str(frame.dtype)
+    }
+
+def raw_frame_janitor():
+    """Thread to delete raw frames older than RAW_FRAME_TTL."""
+    while True:
+        cutoff = time.time() - RAW_FRAME_TTL
+        try:
+            with os.scandir(RAW_FRAME_DIR) as it:
+                for entry in it:
+                    if entry.name.endswith(".raw") and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+        except OSError as e:
+            print(f"⚠️ Raw frame cleanup error: {e}")
+        time.sleep(RAW_FRAME_TTL / 2)
+
 def encode_frame(frame):
-    """Convert frame to base64 bytes for Redis."""
-    _, buffer = cv2.imencode(".jpg", frame)
-    return base64.b64encode(buffer)
+    """Convert frame to raw JPEG bytes for Redis (stream fields are binary-safe)."""
+    if nvjpeg is not None:
+        return nvjpeg.encode(frame, NVJPEG_QUALITY)
+    _, buffer = cv2.imencode(".jpg", frame, JPEG_PARAMS)
+    return buffer.tobytes()
+
+def encoder_worker():
+    """Thread to encode (nvJPEG) queued frames in batches and push them to Redis."""
+    print(f"🧩 Encoder thread started ({'nvJPEG' if nvjpeg is not None else 'CPU encode on camera threads'})")
+
+    while True:
+        # Block for one frame, then drain whatever else is ready (up to ENCODE_BATCH)
+        batch = [encode_queue.get()]
+        while len(batch) < ENCODE_BATCH:
+            try:
+                batch.append(encode_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        # Push frames + metadata to Redis in one round-trip
+        sent = []
+        pipe = r.pipeline(transaction=False)
+        for cam_cfg, frame, timestamp, encoded in batch:
+            try:
+                if encoded is None:
+                    encoded = encode_frame(frame)
+            except Exception as e:
+                print(f"⚠️ Encode failed for {cam_cfg['camera_code']}: {e}")
+                continue
+
+            fields = {
+                **cam_cfg["_encoded"],
+                "timestamp": timestamp,
+                "frame": encoded
+            }
+            if RAW_FRAME_DIR:
+                fields.update(write_raw_frame(frame))
+
+            pipe.xadd("camera_stream", fields)
+            sent.append((cam_cfg, timestamp))
+
+        # A Redis error drops this batch only; the thread keeps draining the queue
+        try:
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            print(f"❌ Failed to push {len(sent)} frames to Redis: {e}")
+            continue
+
+        for cam_cfg, timestamp in sent:
+            print(f"📤 Sent frame: {cam_cfg['plant_id']}-{cam_cfg['site_id']}-{cam_cfg['camera_code']}-time{timestamp}")
 
 def camera_worker(cam_cfg):
-    """Thread to read camera frames and push to Redis."""
+    """Thread to read camera frames and queue them for encoding."""
     cam_id = cam_cfg["camera_code"]  # for logging
     print(f"🎥 Camera thread started: {cam_id}")
 
-    cap = cv2.VideoCapture(cam_cfg["url"])
+    cap = open_capture(cam_cfg["url"])
     if not cap.isOpened():
         print(f"❌ Cannot open {cam_id}")
         return
 
+    live = cam_cfg["url"].startswith(LIVE_PREFIXES)
+    deadline = time.monotonic()
+
     while True:
-        ok, frame = cap.read()
+        # Live streams: keep grabbing (no colour conversion) until the deadline so
+        # the retrieved frame is fresh; files: take exactly one frame per tick
+        ok = cap.grab()
+        while ok and live and time.monotonic() < deadline:
+            ok = cap.grab()
+        if ok:
+            ok, frame = cap.retrieve()
         if not ok:
             print(f"⚠️ {cam_id}: stream ended or cannot read... restarting...")
             cap.release()
             time.sleep(2)
-            cap = cv2.VideoCapture(cam_cfg["url"])
+            cap = open_capture(cam_cfg["url"])
+            deadline = time.monotonic()
             continue
 
-        encoded = encode_frame(frame)
-
         # Add current timestamp in ISO format
         timestamp = datetime.utcnow().isoformat()  # UTC time
 
-        # Push frame + metadata to Redis
-        r.xadd("camera_stream", {
-            "plant_id": cam_cfg["plant_id"],
-            "site_id": cam_cfg["site_id"],
-            "camera_code": cam_cfg["camera_code"],
-            "timestamp": timestamp,
-            "frame": encoded
-        })
+        # CPU JPEG encode here, in parallel across cameras; nvJPEG on the encoder thread
+        try:
+            encoded = encode_frame(frame) if nvjpeg is None else None
+        except cv2.error as e:
+            print(f"⚠️ {cam_id}: encode failed: {e}")
+        else:
+            encode_queue.put((cam_cfg, frame, timestamp, encoded))
 
-        print(f"📤 Sent frame: {cam_cfg['plant_id']}-{cam_cfg['site_id']}-{cam_cfg['camera_code']}-time{timestamp}")
-        time.sleep(cam_cfg["interval"])
+        # Monotonic schedule: sleep only the remaining slack; if behind, drop the backlog
+        deadline += cam_cfg["interval"]
+        slack = deadline - time.monotonic()
+        if slack <= 0:
+            deadline = time.monotonic()
+        elif not live:
+            time.sleep(slack)
 
 print("🚀 Camera streamer started")
 
+threading.Thread(target=encoder_worker, daemon=True).start()
+
+if RAW_FRAME_DIR:
+    os.makedirs(RAW_FRAME_DIR, exist_ok=True)
+    threading.Thread(target=raw_frame_janitor, daemon=True).start()
+
 # Start a thread for each camera
 threads = []
 for cam_cfg in CAMERAS:
+    # Per-camera stream fields never change → encode them once
+    cam_cfg["_encoded"] = {
+        "plant_id": cam_cfg["plant_id"].encode(),
+        "site_id": cam_cfg["site_id"].encode(),
+        "camera_code": cam_cfg["camera_code"].encode()
+    }
+
     t = threading.Thread(
         target=camera_worker,
         args=(cam_cfg,),
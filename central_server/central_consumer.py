@@ -1,12 +1,14 @@
 import redis
-import base64
 import os
+import socket
 import time
 import json
+import functools
+import orjson
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import psycopg2  
-from psycopg2.extras import execute_values 
 
 # -------------------------------------------------------
 # 1. Redis Connection and Postgres Connection
@@ -29,6 +31,18 @@ pg_conn = psycopg2.connect(
 pg_conn.autocommit = True
 pg_cur = pg_conn.cursor()
 
+# Server-side prepared insert (parsed/planned once per session). It takes one
+# array per column, so a whole read of frames goes in with a single EXECUTE.
+pg_cur.execute(
+    """
+    PREPARE ins_frames (text[], text[], text[], text[], text[], text[]) AS
+    INSERT INTO frame_repository (frame_id, plant, site, camera, timestamp, file_path)
+    SELECT * FROM unnest($1, $2, $3, $4, $5, $6)
+    ON CONFLICT (frame_id) DO NOTHING
+    RETURNING frame_id, id
+    """
+)
+
 SHARED_DIR = os.getenv("SHARED_DIR", "/shared")  # mount point inside containers
 SAVE_DIR = os.path.join(SHARED_DIR, "frames")    # /shared/frames
 os.makedirs(SAVE_DIR, exist_ok=True)
@@ -94,12 +108,28 @@ batches = {}              # {"model_name": [...]}
 batch_lock = threading.Lock()
 batch_start_time = {}     # {"model_name": timestamp}
 
+# Frame files are written off the main loop; all writes for one XREAD are
+# awaited before the frame rows are inserted and batched, so the number of
+# writes in flight stays around READ_COUNT.
+writer_pool = ThreadPoolExecutor(max_workers=4)
+made_dirs = set()         # directories already created
+
+# Frames are foldered by hour, so the folder name only changes once an hour
+folder_cache = {}         # {"YYYY-MM-DDTHH": "YYYY_MM_DD_HH"}
+save_dir_cache = {}       # {(plant, site, camera, folder_time): save dir}
+
 
 # -------------------------------------------------------
 # 4. Helpers
 # -------------------------------------------------------
 
 
+@functools.lru_cache(maxsize=1024)
+def decode_field(value):
+    """bytes -> str for per-camera stream fields (same few values every frame)."""
+    return value.decode()
+
+
 def get_models_for_camera(plant_name, site_name, camera_code):
     """
     Return dict of models -> rule_ids for a given plant/site/camera.
@@ -144,28 +174,86 @@ def get_models_for_camera(plant_name, site_name, camera_code):
 
 def dispatch_batch(model_name):
     """Push completed batch to Redis stream."""
+    # Swap the batch out under the lock; serialize + send outside it
     with batch_lock:
-        batch = batches.get(model_name, [])
+        batch = batches.get(model_name)
         if not batch:
             return
 
-        payload = json.dumps(batch)
-        stream_name = f"model_queue:{model_name}"
-
-        r.xadd(stream_name, {"batch": payload})
-        print(f"📤 Sent batch → {model_name} | size={len(batch)}")
-
         batches[model_name] = []
         batch_start_time[model_name] = time.time()
 
+    payload = orjson.dumps(batch)
+    stream_name = f"model_queue:{model_name}"
+
+    r.xadd(stream_name, {"batch": payload})
+    print(f"📤 Sent batch → {model_name} | size={len(batch)}")
+
 
 def add_to_batch(model_name, item):
+    """Append item to the model's batch and return the new batch size."""
     with batch_lock:
         if model_name not in batches:
             batches[model_name] = []
             batch_start_time[model_name] = time.time()
 
         batches[model_name].append(item)
+        return len(batches[model_name])
+
+
+def get_save_dir(plant, site, camera, timestamp):
+    """Return SAVE_DIR/plant/site/camera/YYYY_MM_DD_HH for an ISO timestamp."""
+    hour_key = timestamp[:13]
+    folder_time = folder_cache.get(hour_key)
+    if folder_time is None:
+        folder_time = datetime.fromisoformat(timestamp).strftime("%Y_%m_%d_%H")
+        folder_cache[hour_key] = folder_time
+
+    key = (plant, site, camera, folder_time)
+    save_dir = save_dir_cache.get(key)
+    if save_dir is None:
+        save_dir = os.path.join(SAVE_DIR, *key)
+        save_dir_cache[key] = save_dir
+    return save_dir
+
+
+def write_frame(file_path, frame_bytes):
+    """Write one JPEG to disk (runs on writer_pool). Returns True on success."""
+    try:
+        save_dir = os.path.dirname(file_path)
+        if save_dir not in made_dirs:
+            os.makedirs(save_dir, exist_ok=True)
+            made_dirs.add(save_dir)
+
+        with open(file_path, "wb") as f:
+            f.write(frame_bytes)
+    except OSError as e:
+        print(f"❌ Failed to save {file_path}: {e}")
+        return False
+
+    print(f"✔ Saved {file_path}")
+    return True
+
+
+def insert_frames(rows):
+    """
+    Insert frame rows in a single statement.
+    Return dict of frame_id -> frame_repository.id (existing rows included).
+    """
+    columns = [list(col) for col in zip(*rows)]
+    pg_cur.execute("EXECUTE ins_frames (%s, %s, %s, %s, %s, %s)", columns)
+    db_ids = dict(pg_cur.fetchall())
+
+    # Fetch existing (conflicting rows are not returned)
+    missing = [row[0] for row in rows if row[0] not in db_ids]
+    if missing:
+        pg_cur.execute(
+            "SELECT frame_id, id FROM frame_repository WHERE frame_id = ANY(%s)",
+            (missing,)
+        )
+        db_ids.update(pg_cur.fetchall())
+
+    return db_ids
 
 
 def batch_monitor():
@@ -197,89 +285,121 @@ threading.Thread(target=batch_monitor, daemon=True).start()
 # -------------------------------------------------------
 # 5. MAIN LOOP
 # -------------------------------------------------------
-last_id = "$"   # Read ONLY new messages (important!)
+STREAM_NAME = "camera_stream"
+GROUP_NAME = "central"
+CONSUMER_NAME = os.getenv("CONSUMER_NAME", socket.gethostname())
+READ_COUNT = 64  # max frames pulled per XREADGROUP round-trip
+
+# Consumer group: run several consumers to share the stream; entries stay
+# pending until XACKed. A new group starts at "$" (ONLY new messages).
+try:
+    r.xgroup_create(STREAM_NAME, GROUP_NAME, id="$", mkstream=True)
+except redis.exceptions.ResponseError as e:
+    if "BUSYGROUP" not in str(e):
+        raise
+
+read_id = "0"   # drain this consumer's pending (unacked) entries first, then ">"
 
 while True:
     try:
-        messages = r.xread({"camera_stream": last_id}, block=5000, count=1)
+        messages = r.xreadgroup(GROUP_NAME, CONSUMER_NAME, {STREAM_NAME: read_id},
+                                count=READ_COUNT, block=5000)
         if not messages:
             continue
 
         _, entries = messages[0]
-        msg_id, fields = entries[0]
-        last_id = msg_id
-
-        # Decode metadata
-        plant = fields[b"plant_id"].decode()
-        site = fields[b"site_id"].decode()
-        camera = fields[b"camera_code"].decode()
-        timestamp = fields[b"timestamp"].decode()
-
-        # Determine models (1-to-Many with Key=Model, Value=RuleIDs)
-        target_models_dict = get_models_for_camera(plant, site, camera)
-        if not target_models_dict:
-            print(f"⚠️ No models found for {plant}/{site}/{camera}")
+        if not entries:
+            read_id = ">"   # pending backlog drained, switch to new entries
             continue
+        if read_id != ">":
+            read_id = entries[-1][0]
 
-        # Convert timestamp → folder name
-        ts = datetime.fromisoformat(timestamp)
-        folder_time = ts.strftime("%Y_%m_%d_%H")
+        msg_ids = [msg_id for msg_id, _ in entries]
 
-        # Save decoded image
-        frame_bytes = base64.b64decode(fields[b"frame"])
+        frame_rows = []   # rows for frame_repository
+        pending = []      # (frame_id, write future, batch item, {model: rule_ids})
 
-        save_path = os.path.join(SAVE_DIR, plant, site, camera, folder_time)
-        os.makedirs(save_path, exist_ok=True)
+        for msg_id, fields in entries:
+            if not fields:
+                continue  # pending entry trimmed from the stream
 
-        file_path = os.path.join(save_path, f"{msg_id.decode()}.jpg")
+            # Decode metadata
+            plant = decode_field(fields[b"plant_id"])
+            site = decode_field(fields[b"site_id"])
+            camera = decode_field(fields[b"camera_code"])
+            timestamp = fields[b"timestamp"].decode()
 
-        with open(file_path, "wb") as f:
-            f.write(frame_bytes)
+            # Determine models (1-to-Many with Key=Model, Value=RuleIDs)
+            target_models_dict = get_models_for_camera(plant, site, camera)
+            if not target_models_dict:
+                print(f"⚠️ No models found for {plant}/{site}/{camera}")
+                continue
 
-        print(f"✔ Saved {file_path}")
-        
-        # -------------------------------------------------------
-        # 🟢 ADD: Insert into Postgres BEFORE batching
-        # -------------------------------------------------------
-        pg_cur.execute(
-            """
-            INSERT INTO frame_repository (frame_id, plant, site, camera, timestamp, file_path)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (frame_id) DO NOTHING
-            RETURNING id
-            """,
-            (msg_id.decode(), plant, site, camera, timestamp, file_path)
-        )
-        row = pg_cur.fetchone()
-        
-        if row:
-            db_id = row[0]
-        else:
-             # Fetch existing
-            pg_cur.execute("SELECT id FROM frame_repository WHERE frame_id = %s", (msg_id.decode(),))
-            db_id = pg_cur.fetchone()[0]
+            # Save image (raw JPEG bytes straight from the stream)
+            frame_bytes = fields[b"frame"]
 
-        # -------------------------------------------------------
+            # Convert timestamp → folder name
+            save_path = get_save_dir(plant, site, camera, timestamp)
 
-        # Add to batch for EACH model (Deduplicated)
-        for model, rule_ids in target_models_dict.items():
-            add_to_batch(model, {
+            frame_id = msg_id.decode()
+            file_path = os.path.join(save_path, f"{frame_id}.jpg")
+
+            write_future = writer_pool.submit(write_frame, file_path, frame_bytes)
+
+            item = {
                 "frame_path": file_path,
                 "plant": plant,
                 "site": site,
                 "camera": camera,
-                "timestamp": timestamp,
-                "frame_db_id": db_id,
-                "rule_ids": rule_ids 
-            })
-
-            # Check batch size immediately
-            current_batch = batches.get(model, [])
-            batch_size = config_models.get(model, {}).get("batch_size", 4)
-
-            if len(current_batch) >= batch_size:
-                print(f"📦 Max batch size → {model}")
-                dispatch_batch(model)
+                "timestamp": timestamp
+            }
+
+            # Raw frame shared by the streamer (skips the JPEG decode in workers)
+            if b"raw_path" in fields:
+                item["raw_path"] = fields[b"raw_path"].decode()
+                item["raw_shape"] = fields[b"raw_shape"].decode()
+                item["raw_dtype"] = fields[b"raw_dtype"].decode()
+
+            frame_rows.append((frame_id, plant, site, camera, timestamp, file_path))
+            pending.append((frame_id, write_future, item, target_models_dict))
+
+        # Wait for this read's JPEG writes; frames whose file could not be
+        # written get neither a frame_repository row nor a batch entry
+        stored = []
+        for row, (frame_id, write_future, item, target_models_dict) in zip(frame_rows, pending):
+            if write_future.result():
+                stored.append((row, (frame_id, item, target_models_dict)))
+        frame_rows = [row for row, _ in stored]
+        pending = [entry for _, entry in stored]
+
+        # -------------------------------------------------------
+        # 🟢 ADD: Insert into Postgres BEFORE batching (one statement per read)
+        # -------------------------------------------------------
+        db_ids = insert_frames(frame_rows) if frame_rows else {}
+
+        # -------------------------------------------------------
+
+        for frame_id, item, target_models_dict in pending:
+            db_id = db_ids[frame_id]
+
+            # Add to batch for EACH model (Deduplicated)
+            for model, rule_ids in target_models_dict.items():
+                current_size = add_to_batch(model, {
+                    **item,
+                    "frame_db_id": db_id,
+                    "rule_ids": rule_ids,
+                    "fanout": len(target_models_dict)  # lets workers share one decode across models
+                })
+
+                # Check batch size immediately
+                batch_size = config_models.get(model, {}).get("batch_size", 4)
+
+                if current_size >= batch_size:
+                    print(f"📦 Max batch size → {model}")
+                    dispatch_batch(model)
+
+        # Frames are stored and batched → acknowledge the whole read
+        r.xack(STREAM_NAME, GROUP_NAME, *msg_ids)
 
     except Exception as e:
         print("❌ ERROR:", e)
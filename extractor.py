@@ -1,5 +1,8 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from pathlib import Path
+from typing import Iterator, TextIO, Union
 
 # --- CONFIGURATION ---
 # Folders to completely ignore (os.walk will not descend into these)
@@ -8,77 +11,104 @@ IGNORE_DIRS = {'.git', 'node_modules', '__pycache__', 'postgres_data', 'ThingsTo
 # Specific paths where all file content should be skipped (e.g., image folders)
 # Use relative path strings (e.g., 'shared/frames', 'data/logs')
 SKIP_DETAILS = {'shared/frames', 'assets/images'}
+_SKIP_PREFIXES = tuple(f"{skip_path}/" for skip_path in SKIP_DETAILS)
 
 # Individual filenames to ignore globally
 IGNORE_FILES = {'extractor.py', 'project_report.txt', '.DS_Store'}
 
 OUTPUT_FILE = 'project_report.txt'
 
+# Parallel file reads (I/O bound); entries are read READ_CHUNK at a time
+READ_WORKERS = 32
+READ_CHUNK = 256
+
+# Extensions decided without opening the file; anything else gets the null-byte probe
+TEXT_EXTENSIONS = {'.py', '.md', '.txt', '.json', '.yml', '.yaml', '.toml', '.cfg', '.ini', '.sh', '.sql'}
+BINARY_EXTENSIONS = {'.pt', '.jpg', '.jpeg', '.png', '.gif', '.mp4', '.mkv', '.avi', '.zip', '.pyc', '.so'}
+
 def is_binary(file_path: Path) -> bool:
     """Checks for null bytes (b'\x00') to determine if a file is binary."""
     try:
-        # Read the start of the file in binary mode
-        with open(file_path, 'rb') as f:
-            chunk = f.read(1024)
-            return b'\x00' in chunk
+        # Read the start of the file with a raw fd (no buffered file object)
+        fd = os.open(file_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            if hasattr(os, 'pread'):
+                chunk = os.pread(fd, 1024, 0)
+            else:  # Windows has no pread
+                chunk = os.read(fd, 1024)
+        finally:
+            os.close(fd)
+        return b'\x00' in chunk
     except Exception:
         # Assume true if we cannot even read the file
         return True
 
-def generate_report(root_path: Path) -> str:
-    """Generates a report with folder structure and file content."""
-    report = []
-    
+def _is_skipped(rel_dir_str: str) -> bool:
+    """True for a SKIP_DETAILS directory or anything below it (path-prefix match)."""
+    return rel_dir_str in SKIP_DETAILS or rel_dir_str.startswith(_SKIP_PREFIXES)
+
+def _walk(root_path: Path) -> Iterator[Union[str, Path]]:
+    """Yields report entries in walk order: a skip notice (str) or a candidate file (Path)."""
     for dirpath, dirnames, filenames in os.walk(root_path):
         rel_dir = Path(dirpath).relative_to(root_path)
         rel_dir_str = str(rel_dir).replace('\\', '/')
-
-        # 1. Check if the current directory is inside a path we need to skip (e.g., 'shared/frames/plantA')
-        is_skipped_path = any(
-            # Checks if the skip path is a substring of the current path
-            skip_path in rel_dir_str 
-            for skip_path in SKIP_DETAILS
-        )
-
-        if is_skipped_path:
-            # Prune traversal: stop walking into any subdirectories of the current path
-            dirnames[:] = [] 
-            # Prune files: stop processing any files in the current directory
-            filenames[:] = [] 
-            
-            # Log the skip only for the top-level skipped folder to keep the report concise
-            if rel_dir_str in SKIP_DETAILS:
-                 report.append(f"\n[Content skipped: {rel_dir_str}]")
-            continue 
-        
-        # 2. Prune globally ignored directories (if they are not already pruned by SKIP_DETAILS)
-        dirnames[:] = [d for d in dirnames if d not in IGNORE_DIRS]
+        if rel_dir_str == '.':
+            rel_dir_str = ''
+
+        # Decide skips per directory and prune them here, so os.walk never descends into them
+        skipped_dirs = []
+        kept_dirs = []
+        for d in dirnames:
+            rel_child = f"{rel_dir_str}/{d}" if rel_dir_str else d
+            if _is_skipped(rel_child):
+                skipped_dirs.append(rel_child)
+            elif d not in IGNORE_DIRS:
+                kept_dirs.append(d)
+        dirnames[:] = kept_dirs
 
         for filename in filenames:
             if filename in IGNORE_FILES:
                 continue
+            yield Path(dirpath) / filename
+
+        # Log the skip for the top-level skipped folder only to keep the report concise
+        for rel_child in skipped_dirs:
+            yield f"\n[Content skipped: {rel_child}]\n"
 
-            file_path = Path(dirpath) / filename
-            rel_file = file_path.relative_to(root_path)
+def _read(entry: Union[str, Path], root_path: Path) -> str:
+    """Renders one report entry; binary/unreadable files render as an empty string."""
+    if isinstance(entry, str):
+        return entry
 
-            # Check if file is binary/unreadable and skip printing the entry entirely
-            if is_binary(file_path):
-                continue 
-            
-            # --- START PRINTING FILE DETAILS ---
-            report.append(f"\n{'='*50}")
-            report.append(f"FILE: {rel_file}")
-            report.append(f"{'='*50}\n")
+    # Check if file is binary/unreadable and skip printing the entry entirely
+    suffix = entry.suffix.lower()
+    if suffix in BINARY_EXTENSIONS:
+        return ''
+    if suffix not in TEXT_EXTENSIONS and is_binary(entry):
+        return ''
 
-            try:
-                # Use errors='ignore' to handle minor encoding issues in text files gracefully
-                content = file_path.read_text(encoding='utf-8', errors='ignore')
-                report.append(content)
-            except Exception as e:
-                # Should be rare after the is_binary check, but good for safety
-                report.append(f"[Error reading text file: {e}]")
+    # --- START PRINTING FILE DETAILS ---
+    header = f"\n{'='*50}\nFILE: {entry.relative_to(root_path)}\n{'='*50}\n\n"
 
-    return '\n'.join(report)
+    try:
+        # Use errors='ignore' to handle minor encoding issues in text files gracefully
+        content = entry.read_text(encoding='utf-8', errors='ignore')
+        return header + content + '\n'
+    except Exception as e:
+        # Should be rare after the is_binary check, but good for safety
+        return header + f"[Error reading text file: {e}]\n"
+
+def generate_report(root_path: Path, out: TextIO) -> None:
+    """Writes a report with folder structure and file content to `out`."""
+    # Fast walk first, then overlap the per-file reads; map() keeps walk order
+    entries = list(_walk(root_path))
+
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as pool:
+        # Chunked so finished-but-unwritten files stay bounded in memory
+        for i in range(0, len(entries), READ_CHUNK):
+            chunk = entries[i:i + READ_CHUNK]
+            for text in pool.map(_read, chunk, repeat(root_path)):
+                out.write(text)
 
 def main():
     root_folder = Path.cwd()
@@ -89,11 +119,11 @@ def main():
         return
 
     print('Starting report generation...')
-    report = generate_report(root_folder)
-    
-    # Save report
+
+    # Stream the report straight to disk instead of building it in memory
     try:
-        output_path.write_text(report, encoding='utf-8')
+        with output_path.open('w', encoding='utf-8') as out:
+            generate_report(root_folder, out)
         print(f"Report saved to {output_path}")
     except Exception as e:
         print(f"Error saving report: {e}")
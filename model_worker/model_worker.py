@@ -1,25 +1,49 @@
 import os
 import time
+import io
 import json
+import queue
+import socket
+import sys
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import struct
+import fcntl
+import shutil
+import tempfile
+import orjson
 import redis
 import base64
-import traceback
 import threading
-from datetime import datetime
+import multiprocessing as mp
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import cv2
+import numpy as np
 from abc import ABC, abstractmethod
 
 # Optional imports for specific backends
 try:
     from ultralytics import YOLO
+    from ultralytics.utils import ops
     import torch
 except ImportError:
     YOLO = None
+    ops = None
     torch = None
-    print("YOLO not installed or failed to import")
+    logging.getLogger("model_worker").warning("YOLO not installed or failed to import")
+
+# Optional libjpeg-turbo decoder (PyTurboJPEG); falls back to cv2.imread
+try:
+    from turbojpeg import TurboJPEG
+    turbo_jpeg = TurboJPEG()
+except Exception:
+    turbo_jpeg = None
+    logging.getLogger("model_worker").warning("TurboJPEG not available, decoding frames with OpenCV")
 
 import psycopg2
-from psycopg2.extras import Json
+from psycopg2.extras import execute_values
 
 
 
@@ -37,6 +61,70 @@ SHARED_DIR = os.getenv("SHARED_DIR", "/shared")
 MODELS_DIR = os.path.join(SHARED_DIR, "models")
 MODELS_CONFIG_PATH = os.path.join(SHARED_DIR, "configs", "models_config.json")
 
+# Batches decoded/uploaded ahead of the one being inferred
+PREFETCH_DEPTH = 2
+
+# Redis consumer group for model_queue:* streams
+GROUP_NAME = "model_workers"
+CONSUMER_NAME = os.getenv("CONSUMER_NAME", socket.gethostname())
+MAX_BUNDLE_IMAGES = 32  # stream messages are bundled into one inference batch up to ~this size
+
+# Decoded + letterboxed frames shared by the models of one process (entries)
+FRAME_CACHE_SIZE = int(os.getenv("FRAME_CACHE_SIZE", "16"))
+
+# Worker processes (0 = one per model); each runs one Redis dispatcher for
+# the models it hosts. Optional comma separated GPU list, e.g. "0,1",
+# assigned to worker processes round-robin
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+GPU_DEVICES = [d for d in os.getenv("GPU_DEVICES", "").split(",") if d.strip()]
+
+# Annotated detection images (written by a background pool). Each queued
+# write pins a full-resolution frame, so at most this many are in flight
+# per model; beyond that inference waits for the writers
+ANNOTATION_JPEG_PARAMS = [int(cv2.IMWRITE_JPEG_QUALITY), 85]
+MAX_PENDING_ANNOTATIONS = int(os.getenv("MAX_PENDING_ANNOTATIONS", "16"))
+# Box colours per class id (Ultralytics' palette, RGB hex → BGR)
+BOX_COLORS = [
+    tuple(int(h[i:i + 2], 16) for i in (4, 2, 0))
+    for h in ("FF3838", "FF9D97", "FF701F", "FFB21D", "CFD231", "48F90A", "92CC17",
+              "3DDB86", "1A9334", "00D4BB", "2C99A8", "00C2FF", "344593", "6473FF",
+              "0018EC", "8438FF", "520085", "CB38FF", "FF95C8", "FF37C7")
+]
+
+# Binary COPY framing: signature + flags + header extension length / end marker
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+COPY_TRAILER = struct.pack("!h", -1)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+log = logging.getLogger("model_worker")
+
+# ---------------------------------------------------------
+# LOGGING
+# ---------------------------------------------------------
+def setup_logging():
+    """
+    Route this process' records through a queue; a listener thread does the
+    stdout I/O, so logging never blocks the inference/prefetch threads.
+    """
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s] %(message)s"))
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.handlers[:] = [QueueHandler(log_queue)]
+    root.setLevel(LOG_LEVEL)
+
+# ---------------------------------------------------------
+# TORCH SETUP
+# ---------------------------------------------------------
+def disable_grad():
+    """Inference only: turn autograd off for the calling thread (the flag is thread-local)."""
+    if torch is not None:
+        torch.set_grad_enabled(False)
+
 # ---------------------------------------------------------
 # DATABASE & REDIS HELPERS
 # ---------------------------------------------------------
@@ -48,12 +136,218 @@ def get_pg_connection():
         user=PG_USER,
         password=PG_PASSWORD
     )
-    conn.autocommit = True
+    # Each batch's results are written in one explicit transaction
+    conn.autocommit = False
     return conn
 
+def prepare_statements(pg_cursor):
+    """
+    Per-connection staging table (temp = no WAL, emptied on commit) that
+    detections are COPY'd into, plus a prepared upsert from it into
+    model_detections, so a batch costs one COPY + one EXECUTE.
+    """
+    pg_cursor.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS model_detections_staging (
+            frame_id INT,
+            model_id INT,
+            detection JSONB
+        ) ON COMMIT DELETE ROWS
+        """
+    )
+    pg_cursor.execute(
+        """
+        PREPARE upsert_staged AS
+        INSERT INTO model_detections (frame_id, model_id, detection)
+        SELECT frame_id, model_id, detection FROM model_detections_staging
+        ON CONFLICT (frame_id, model_id)
+        DO UPDATE SET detection = EXCLUDED.detection, timestamp = NOW()
+        """
+    )
+    pg_cursor.connection.commit()
+
+def open_pg_session():
+    """New connection + cursor with this worker's staging table and prepared statement."""
+    pg_conn = get_pg_connection()
+    pg_cursor = pg_conn.cursor()
+    prepare_statements(pg_cursor)
+    return pg_conn, pg_cursor
+
+def encode_copy_binary(rows):
+    """
+    Encode (int4, int4, json bytes) rows in PostgreSQL's binary COPY format.
+    jsonb's binary form is a version byte (1) + the JSON text, so the server
+    skips text-format tuple parsing.
+    """
+    parts = [COPY_HEADER]
+    for frame_id, model_id, payload in rows:
+        parts.append(struct.pack("!hiiiii", 3, 4, frame_id, 4, model_id, len(payload) + 1))
+        parts.append(b"\x01")
+        parts.append(payload)
+    parts.append(COPY_TRAILER)
+    return b"".join(parts)
+
+def copy_detections(pg_cursor, rows):
+    """COPY rows into the staging table and upsert them into model_detections."""
+    pg_cursor.copy_expert(
+        "COPY model_detections_staging (frame_id, model_id, detection) FROM STDIN WITH (FORMAT BINARY)",
+        io.BytesIO(encode_copy_binary(rows))
+    )
+    pg_cursor.execute("EXECUTE upsert_staged")
+
 def get_redis_connection():
     return redis.StrictRedis(host=REDIS_HOST, port=6379, db=0)
 
+# ---------------------------------------------------------
+# FRAME CACHE
+# ---------------------------------------------------------
+class FrameCache:
+    """
+    LRU of (image, letterboxed, letterbox) per (frame_path, imgsz), shared by
+    the backends of one process so a frame routed to several models is decoded
+    and letterboxed once. An entry is dropped after its last expected use.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # key -> [image, letterboxed, letterbox, uses_left]
+        self.lock = threading.Lock()
+
+    def take(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            entry[3] -= 1
+            if entry[3] <= 0:
+                del self.entries[key]
+            else:
+                self.entries.move_to_end(key)
+            return entry[0], entry[1], entry[2]
+
+    def put(self, key, image, letterboxed, letterbox, uses):
+        if uses <= 0:
+            return
+        with self.lock:
+            self.entries[key] = [image, letterboxed, letterbox, uses]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+# Set in model_process when it hosts more than one model
+frame_cache = None
+
+# ---------------------------------------------------------
+# IMAGE HELPERS
+# ---------------------------------------------------------
+def load_raw_frame(item):
+    """Read the streamer's raw BGR frame from shared memory, or None if gone."""
+    try:
+        shape = tuple(int(d) for d in item["raw_shape"].split(","))
+        return np.fromfile(item["raw_path"], dtype=item["raw_dtype"]).reshape(shape)
+    except (OSError, ValueError):
+        return None
+
+def read_jpeg(path):
+    """Decode a frame JPEG to BGR (TurboJPEG when available), or None if unreadable."""
+    if turbo_jpeg is not None:
+        try:
+            with open(path, "rb") as f:
+                return turbo_jpeg.decode(f.read())  # BGR by default
+        except OSError:
+            pass  # missing/corrupt file: let OpenCV have a go (and fail the same way)
+    return cv2.imread(path, cv2.IMREAD_COLOR)
+
+def load_images(batch, imgsz=None):
+    """
+    Decode batch frames to BGR arrays. Returns (readable batch items, images,
+    letterboxed); with the process' frame_cache active (and imgsz given),
+    letterboxed holds an (array, letterbox) per image, else it is None.
+    """
+    cache = frame_cache if imgsz else None
+    kept, images, letterboxed = [], [], []
+    for item in batch:
+        key = (item["frame_path"], imgsz)
+        cached = cache.take(key) if cache else None
+        if cached is not None:
+            img, boxed = cached[0], cached[1:]
+        else:
+            img = load_raw_frame(item) if "raw_path" in item else None
+            if img is None:
+                img = read_jpeg(item["frame_path"])
+            if img is None:
+                log.warning(f"⚠️ Could not read frame: {item['frame_path']}")
+                continue
+            boxed = None
+            if cache:
+                out = np.empty((imgsz, imgsz, 3), dtype=np.uint8)
+                boxed = (out, letterbox_into(img, out, imgsz))
+                # "fanout" = models the frame was routed to, this one included
+                cache.put(key, img, *boxed, uses=item.get("fanout", 1) - 1)
+        kept.append(item)
+        images.append(img)
+        letterboxed.append(boxed)
+    return kept, images, (letterboxed if cache else None)
+
+def draw_detections(img, detections, names):
+    """Draw boxes + "name conf" labels onto the BGR frame in place."""
+    for det in detections:
+        x1, y1, x2, y2 = (int(v) for v in det["xyxy"])
+        color = BOX_COLORS[det["cls"] % len(BOX_COLORS)]
+        label = f"{names.get(det['cls'], det['cls'])} {det['conf']:.2f}"
+
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2, cv2.LINE_AA)
+        (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+        ty = y1 if y1 - th - 4 >= 0 else y1 + th + 4  # keep the label inside the frame
+        cv2.rectangle(img, (x1, ty - th - 4), (x1 + tw + 2, ty), color, -1)
+        cv2.putText(img, label, (x1 + 1, ty - 3), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                    (255, 255, 255), 1, cv2.LINE_AA)
+    return img
+
+def save_annotated(img, detections, names, save_path, model_name, rule_ids):
+    """Draw detections on the decoded frame and write the JPEG (runs on the annotation writer pool)."""
+    model_log = logging.getLogger(model_name)
+    try:
+        plotted_img = draw_detections(img, detections, names)
+        ok, buffer = cv2.imencode(".jpg", plotted_img, ANNOTATION_JPEG_PARAMS)
+        if not ok:
+            raise ValueError("JPEG encode failed")
+
+        data = memoryview(buffer)
+        fd = os.open(save_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+        model_log.debug(f"📸 Saved detection: {save_path} (Rules: {rule_ids})")
+    except Exception as e:
+        model_log.warning(f"⚠️ Failed to save annotation {save_path}: {e}")
+
+def letterbox_into(img, out, size):
+    """
+    Resize img (keeping aspect ratio) into the centre of out (size x size x 3),
+    padding with grey like Ultralytics' LetterBox. Returns (gain, pad_w, pad_h).
+    """
+    h, w = img.shape[:2]
+    gain = min(size / h, size / w)
+    new_w, new_h = int(round(w * gain)), int(round(h * gain))
+    pad_w = int(round((size - new_w) / 2 - 0.1))
+    pad_h = int(round((size - new_h) / 2 - 0.1))
+
+    out[:] = 114
+    if (new_w, new_h) != (w, h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    out[pad_h:pad_h + new_h, pad_w:pad_w + new_w] = img
+    return gain, pad_w, pad_h
+
+def unletterbox_boxes(data, letterbox, orig_shape):
+    """Map (n, 6) [x1, y1, x2, y2, conf, cls] rows from letterbox to original image coords."""
+    gain, pad_w, pad_h = letterbox
+    h, w = orig_shape[:2]
+    data[:, [0, 2]] = ((data[:, [0, 2]] - pad_w) / gain).clamp(0, w)
+    data[:, [1, 3]] = ((data[:, [1, 3]] - pad_h) / gain).clamp(0, h)
+    return data
+
 # ---------------------------------------------------------
 # ABSTRACT BACKEND
 # ---------------------------------------------------------
@@ -62,17 +356,94 @@ class ModelBackend(ABC):
         self.model_name = model_name
         self.config = config
         self.device = "cpu"
+        self.log = logging.getLogger(model_name)
+
+        # Annotation output dirs per (plant, site, camera): the camera's
+        # detected_frames prefix and its current ("YYYY-MM-DDTHH", created dir)
+        self._prefix_cache = {}
+        self._hour_dirs = {}
+
+        # Parsed (msg_ids, batch) bundles from the process' dispatcher
+        self.in_queue = queue.Queue(maxsize=PREFETCH_DEPTH)
+        # Set by the worker after a connection failure: the dispatcher then
+        # re-reads this model's pending (unacked) entries from "0"
+        self.redeliver = threading.Event()
+
+    def detection_save_dir(self, plant, site, camera, timestamp):
+        """Return (and create once) SHARED_DIR/detected_frames/plant/site/camera/YYYY_MM_DD_HH."""
+        cam = (plant, site, camera)
+        hour_key = timestamp[:13]
+        current = self._hour_dirs.get(cam)
+        if current is not None and current[0] == hour_key:
+            return current[1]
+
+        # New hour for this camera (cache holds one entry per camera, so it stays bounded)
+        prefix = self._prefix_cache.get(cam)
+        if prefix is None:
+            prefix = os.path.join(SHARED_DIR, "detected_frames", plant, site, camera)
+            self._prefix_cache[cam] = prefix
+
+        # ISO "2023-05-01T12..." → "2023_05_01_12" without parsing a datetime
+        save_dir = f"{prefix}/{hour_key.replace('-', '_').replace('T', '_')}"
+        os.makedirs(save_dir, exist_ok=True)
+        self._hour_dirs[cam] = (hour_key, save_dir)
+        return save_dir
         
     @abstractmethod
     def load(self):
         """Load the model into memory. Raise Exception if file missing."""
         pass
 
+    def preprocess(self, images, letterboxed=None):
+        """
+        Optional work done on the prefetch thread ahead of infer()
+        (e.g. resize + H2D upload). letterboxed optionally carries already
+        letterboxed (array, letterbox) pairs from the frame cache.
+        Returns an opaque object passed to infer().
+        """
+        return None
+
     @abstractmethod
-    def infer(self, image_paths):
-        """Run inference on a list of image paths. Returns list of dicts."""
+    def infer(self, images, image_paths, prepared=None):
+        """Run inference on a list of decoded BGR images. Returns list of dicts."""
         pass
 
+# ---------------------------------------------------------
+# CUDA GRAPHS
+# ---------------------------------------------------------
+class CUDAGraphRunner:
+    """Replays a CUDA graph of net(static_in) captured for one fixed batch shape."""
+    def __init__(self, net, static_in, pool=None):
+        # static_in is a view of an input buffer shared by all runners
+        self.static_in = static_in
+
+        # Warm up on a side stream (cuDNN autotune, allocator) before capturing
+        s = torch.cuda.Stream()
+        s.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(s):
+            for _ in range(3):
+                net(self.static_in)
+        torch.cuda.current_stream().wait_stream(s)
+
+        self.graph = torch.cuda.CUDAGraph()
+        # thread_local: CUDA work other threads may still issue (prefetch
+        # uploads, other models) must not invalidate this capture
+        with torch.cuda.graph(self.graph, pool=pool, capture_error_mode="thread_local"):
+            self.static_out = net(self.static_in)
+
+        # The Detect head rebuilds anchors/strides whenever the input shape
+        # (batch included) changes, i.e. when another batch size is warmed up
+        # or captured. Keep the tensors this graph was recorded against alive
+        # so the allocator cannot hand their memory out before a replay.
+        head = net.model[-1] if hasattr(net, "model") else None
+        self.head_tensors = (getattr(head, "anchors", None), getattr(head, "strides", None))
+
+    def __call__(self, x):
+        """Run the captured graph on x (rows beyond len(x) keep stale data)."""
+        self.static_in[:len(x)].copy_(x)
+        self.graph.replay()
+        return self.static_out
+
 # ---------------------------------------------------------
 # YOLO BACKEND
 # ---------------------------------------------------------
@@ -83,89 +454,525 @@ class YOLOBackend(ModelBackend):
         # Always look inside /shared/models/
         weights_name = config.get("weights_file", f"{model_name}.pt")
         self.weights_file = os.path.join(MODELS_DIR, weights_name)
+        self.half = False
+        self.imgsz = config.get("imgsz", 640)
+        self.conf = config.get("conf", 0.25)
+        self.iou = config.get("iou", 0.7)
+
+        # TensorRT engine with a static batch (GPU only, see load())
+        self.engine_file = None
+        self.engine_batch = None
+
+        # Raw nn.Module fed our own letterboxed tensors (.pt weights only),
+        # optionally torch.compile'd for a static batch_size input
+        self.net = None
+        self.compiled = False
+
+        # CUDA graphs per padded batch size (GPU only): powers of two up to
+        # batch_size, so at most log2(batch_size) + 1 graphs per model; all
+        # graphs share one input buffer and one memory pool
+        self.use_graphs = False
+        self.graph_runners = {}
+        self.graph_pool = None
+        self.static_in = None
+
+        # GPU input pipeline (set up in load()): pool of pinned host buffers
+        # (B, H, W, 3) plus separate streams for H2D copies and compute
+        self._host_pool = None
+        self.copy_stream = None
+        self.compute_stream = None
 
         # Check for GPU
         if torch and torch.cuda.is_available():
             self.device = 0
-            print(f"[{self.model_name}] 💠 GPU detected! Using CUDA.")
+            self.half = config.get("half", True)  # FP16 on tensor cores (set false to debug in FP32)
+            self.log.info("💠 GPU detected! Using CUDA.")
+
+            # Opt-in: static-batch TensorRT engine next to the .pt weights.
+            # Needs tensorrt/onnx installed in the image (Ultralytics would
+            # otherwise try to pip-install them at export time)
+            if config.get("tensorrt", False) and self.weights_file.endswith(".pt"):
+                self.engine_batch = config.get("batch_size", 1)
+                stem = os.path.splitext(self.weights_file)[0]
+                precision = "fp16" if self.half else "fp32"
+                self.engine_file = f"{stem}_b{self.engine_batch}_{precision}.engine"
         else:
-            print(f"[{self.model_name}] ⬛ CPU mode")
+            self.log.info("⬛ CPU mode")
 
     def load(self):
         if YOLO is None:
             # raise ImportError("Ultralytics not installed")
-            print("Ultralytics not installed")
+            self.log.warning("Ultralytics not installed")
 
         # Check if weights file exists locally
         if not os.path.exists(self.weights_file):
             raise FileNotFoundError(
                 f"⚠️ Weights file missing locally (no download allowed): {self.weights_file}"
             )
-        print(f"[{self.model_name}] 📦 Loading YOLO model: {self.weights_file} on {self.device}...")
+        if self.engine_file:
+            if not os.path.exists(self.engine_file):
+                self._export_engine()
+            if os.path.exists(self.engine_file):
+                self.weights_file = self.engine_file
+            else:
+                self.engine_batch = None
+
+        self.log.info(f"📦 Loading YOLO model: {self.weights_file} on {self.device}...")
         self.model = YOLO(self.weights_file)
-        self.model.to(self.device)
-        print(f"[{self.model_name}] ✨ YOLO loaded.")
+        if self.weights_file.endswith(".pt"):
+            # Exported engines are bound to their device at predict time
+            self.model.to(self.device)
+
+            # Raw nn.Module (fused conv+bn, eval, FP16 on GPU) so inference
+            # skips the Ultralytics predictor's per-image preprocessing
+            # requires_grad_(False): no autograd bookkeeping on any thread,
+            # even outside inference_mode (graph capture, compile warm-up)
+            self.net = self.model.model.fuse(verbose=False).eval().requires_grad_(False)
+            if self.half:
+                self.net.half()
+
+            if self.config.get("torch_compile", False):
+                self._compile_net()
+            elif self.device != "cpu" and self.config.get("cuda_graphs", True):
+                self.use_graphs = True
+                self.graph_pool = torch.cuda.graph_pool_handle()
+
+        if self.device != "cpu":
+            # One buffer in compute, one being filled, PREFETCH_DEPTH queued
+            self._host_pool = queue.Queue()
+            for _ in range(PREFETCH_DEPTH + 2):
+                self._host_pool.put(self._alloc_host_buffer(self.config.get("batch_size", 1)))
+            self.copy_stream = torch.cuda.Stream()
+            self.compute_stream = torch.cuda.Stream()
+
+        if self.use_graphs:
+            self._capture_graphs()
+        self.log.info("✨ YOLO loaded.")
+
+    def _export_engine(self):
+        """
+        AOT-compile the .pt weights to a static-batch TensorRT engine (first
+        load only). Worker processes start together, so the export runs under
+        a per-engine file lock and from a private copy of the weights:
+        Ultralytics writes its .onnx/.engine next to the source file, which
+        exports of the same weights at other batch sizes would share.
+        """
+        with open(f"{self.engine_file}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(self.engine_file):
+                return  # built by another process while we waited
+
+            self.log.info(f"🏗️ Exporting TensorRT engine: {self.engine_file} (batch={self.engine_batch})")
+            export_dir = tempfile.mkdtemp(prefix=".export_", dir=os.path.dirname(self.engine_file))
+            try:
+                weights_copy = os.path.join(export_dir, os.path.basename(self.weights_file))
+                shutil.copy2(self.weights_file, weights_copy)
+                exported = YOLO(weights_copy).export(
+                    format="engine",
+                    imgsz=self.imgsz,
+                    half=self.half,
+                    batch=self.engine_batch,
+                    dynamic=False,
+                    workspace=4,
+                    device=self.device
+                )
+                os.replace(exported, self.engine_file)
+            except Exception as e:
+                self.log.warning(f"⚠️ TensorRT export failed, using PyTorch weights: {e}")
+            finally:
+                shutil.rmtree(export_dir, ignore_errors=True)
+
+    def _compile_net(self):
+        """
+        torch.compile the fused module (Inductor). On GPU "reduce-overhead" also
+        captures CUDA graphs itself, so our own graph runners stay off.
+        """
+        mode = "reduce-overhead" if self.device != "cpu" else "default"
+        self.log.info(f"🔥 torch.compile (mode={mode}), warming up...")
+        self.net = torch.compile(self.net, mode=mode, fullgraph=False)
+        self.compiled = True
+
+        # Prime Inductor at the one shape _compiled_forward feeds it
+        b = self.config.get("batch_size", 1)
+        x = torch.zeros((b, 3, self.imgsz, self.imgsz), device=self.device,
+                        dtype=torch.float16 if self.half else torch.float32)
+        with torch.inference_mode():
+            for _ in range(3):
+                self.net(x)
+
+    def _alloc_host_buffer(self, n):
+        return torch.empty((n, self.imgsz, self.imgsz, 3), dtype=torch.uint8, pin_memory=True)
+
+    def preprocess(self, images, letterboxed=None):
+        """
+        Letterbox images (runs on the prefetch thread). On GPU they go into a
+        pooled pinned buffer and the H2D copy + normalisation is started on
+        the copy stream; on CPU a numpy batch is returned for _infer_cpu.
+        """
+        if self.device == "cpu":
+            if self.net is None:
+                return None  # exported formats letterbox inside the predictor
+            host = np.empty((len(images), self.imgsz, self.imgsz, 3), dtype=np.uint8)
+            return host, self._letterbox_batch(images, letterboxed, host)
+
+        n = len(images)
+        host = self._host_pool.get()  # blocks while all buffers are in flight
+        if host.shape[0] < n:
+            host = self._alloc_host_buffer(n)
+
+        try:
+            with torch.inference_mode():
+                letterboxes = self._letterbox_batch(images, letterboxed, host.numpy())
+
+                with torch.cuda.stream(self.copy_stream):
+                    # Only uint8 crosses PCIe (half the bytes of an FP16 upload)
+                    raw = host[:n].to(self.device, non_blocking=True)
+                    # HWC BGR uint8 → CHW RGB in [0, 1]: one kernel per channel reads
+                    # the strided BGR plane and writes the scaled, cast RGB plane
+                    # (no flipped/permuted uint8 intermediate, no separate div pass)
+                    x = torch.empty((n, 3, self.imgsz, self.imgsz), device=self.device,
+                                    dtype=torch.float16 if self.half else torch.float32)
+                    for c in range(3):
+                        torch.div(raw[..., 2 - c], 255, out=x[:, c])
+                    ready = torch.cuda.Event()
+                    ready.record(self.copy_stream)
+        except Exception:
+            self._host_pool.put(host)
+            raise
+
+        return x, letterboxes, ready, host
+
+    def _letterbox_batch(self, images, letterboxed, out):
+        """Fill out[i] with each letterboxed image (copied from the frame cache when available)."""
+        if letterboxed is None:
+            return [letterbox_into(img, out[i], self.imgsz) for i, img in enumerate(images)]
+
+        letterboxes = []
+        for i, img in enumerate(images):
+            if letterboxed[i] is None:
+                letterboxes.append(letterbox_into(img, out[i], self.imgsz))
+            else:
+                arr, letterbox = letterboxed[i]
+                out[i] = arr
+                letterboxes.append(letterbox)
+        return letterboxes
+
+    def _capture_graphs(self):
+        """
+        Capture every padded batch size _replay can ask for (powers of two
+        below batch_size, plus batch_size) up front, while load() runs before
+        any prefetch/worker thread issues CUDA work, like _compile_net's warm-up.
+        """
+        max_b = self.config.get("batch_size", 1)
+        self.static_in = torch.zeros((max_b, 3, self.imgsz, self.imgsz), device=self.device,
+                                     dtype=torch.float16 if self.half else torch.float32)
+        sizes = []
+        padded = 1
+        while padded < max_b:
+            sizes.append(padded)
+            padded *= 2
+        sizes.append(max_b)
+
+        with torch.inference_mode():
+            for padded in sizes:
+                self.log.info(f"📸 Capturing CUDA graph for batch={padded}")
+                self.graph_runners[padded] = CUDAGraphRunner(self.net, self.static_in[:padded],
+                                                             pool=self.graph_pool)
+
+    def _graph_forward(self, x):
+        """
+        Forward x through CUDA graphs. Inputs larger than batch_size (bundled
+        stream messages) are replayed in batch_size chunks.
+        """
+        max_b = self.config.get("batch_size", 1)
+        if len(x) <= max_b:
+            return self._replay(x, max_b)
+        # Replays of one graph share static_out, so each chunk is copied out
+        return torch.cat([self._replay(x[i:i + max_b], max_b).clone() for i in range(0, len(x), max_b)])
+
+    def _replay(self, x, max_b):
+        """
+        Replay the graph captured (in load()) for the next power-of-two batch
+        size (capped at max_b), padding odd batches. Returns raw preds for the
+        len(x) images.
+        """
+        n = len(x)
+        padded = 1
+        while padded < n:
+            padded *= 2
+        padded = min(padded, max_b)
+
+        preds = self.graph_runners[padded](x)
+        preds = preds[0] if isinstance(preds, (list, tuple)) else preds
+        return preds[:n]
+
+    def _forward(self, x):
+        """Raw network preds for a letterboxed (B, 3, H, W) tensor."""
+        if self.use_graphs:
+            return self._graph_forward(x)
+        if self.compiled:
+            return self._compiled_forward(x)
+        preds = self.net(x)
+        return preds[0] if isinstance(preds, (list, tuple)) else preds
+
+    def _compiled_forward(self, x):
+        """
+        Compiled net in zero-padded batch_size chunks: one static shape means
+        no recompiles (and one cudagraph) whatever the bundle size.
+        """
+        step = self.config.get("batch_size", len(x))
+        outs = []
+        for i in range(0, len(x), step):
+            chunk = x[i:i + step]
+            n = len(chunk)
+            if n < step:
+                chunk = torch.cat([chunk, chunk.new_zeros((step - n,) + tuple(chunk.shape[1:]))])
+            preds = self.net(chunk)
+            preds = preds[0] if isinstance(preds, (list, tuple)) else preds
+            # reduce-overhead outputs are overwritten by the next replay
+            outs.append(preds[:n].clone())
+        return outs[0] if len(outs) == 1 else torch.cat(outs)
+
+    def _predict(self, x):
+        """
+        Ultralytics predictor on a device tensor. A static-batch engine only
+        accepts engine_batch images, so x is fed in zero-padded chunks of that size.
+        """
+        step = self.engine_batch or len(x)
+        boxes_list = []
+        for i in range(0, len(x), step):
+            chunk = x[i:i + step]
+            n = len(chunk)
+            if n < step:
+                chunk = torch.cat([chunk, chunk.new_zeros((step - n,) + tuple(chunk.shape[1:]))])
+
+            results_raw = self.model(chunk, device=self.device, half=self.half,
+                                     conf=self.conf, iou=self.iou, verbose=False)
+            boxes_list += [res.boxes.data.clone() for res in results_raw[:n]]
+        return boxes_list
+
+    def _infer_gpu(self, images, prepared):
+        """Run YOLO on a pre-letterboxed device tensor; per-image boxes mapped back to original frames."""
+        x, letterboxes, ready, _ = prepared
+
+        # Compute stream waits only for this batch's copy, so the next
+        # batch's upload on the copy stream overlaps with this forward pass
+        with torch.cuda.stream(self.compute_stream):
+            self.compute_stream.wait_event(ready)
+            x.record_stream(self.compute_stream)
+
+            if self.net is not None:
+                # NMS runs outside the graph on the static output
+                preds = self._forward(x)
+                boxes_list = ops.non_max_suppression(preds, self.conf, self.iou, max_det=300)
+            else:
+                boxes_list = self._predict(x)
+        torch.cuda.current_stream().wait_stream(self.compute_stream)
+
+        return self._unletterbox_all(images, boxes_list, letterboxes)
+
+    def _infer_cpu(self, images, prepared):
+        """CPU counterpart of _infer_gpu: raw forward + NMS on the letterboxed batch, no predictor."""
+        host, letterboxes = prepared
+
+        # HWC BGR uint8 → CHW RGB in [0, 1]
+        x = torch.from_numpy(host).permute(0, 3, 1, 2).flip(1).float().div_(255)
+        preds = self._forward(x)
+        boxes_list = ops.non_max_suppression(preds, self.conf, self.iou, max_det=300)
+        return self._unletterbox_all(images, boxes_list, letterboxes)
+
+    def _unletterbox_all(self, images, boxes_list, letterboxes):
+        """Map per-image (n, 6) NMS output from letterbox to original frame coords."""
+        return [unletterbox_boxes(boxes, letterboxes[i], images[i].shape) for i, boxes in enumerate(boxes_list)]
+
+    def infer(self, images, image_paths, prepared=None):
+        if prepared is None:
+            prepared = self.preprocess(images)
+
+        try:
+            with torch.inference_mode():
+                # Per-image (n, 6) [x1, y1, x2, y2, conf, cls] tensors in frame coords
+                if self.device == "cpu" and self.net is not None:
+                    boxes_list = self._infer_cpu(images, prepared)
+                elif self.device == "cpu":
+                    # Exported formats: Ultralytics handles batching + letterboxing
+                    results_raw = self.model(images, device=self.device,
+                                             conf=self.conf, iou=self.iou, verbose=False)
+                    boxes_list = [res.boxes.data for res in results_raw]
+                else:
+                    boxes_list = self._infer_gpu(images, prepared)
+
+            # One device→host copy for the whole batch instead of three syncs per box
+            counts = [len(boxes) for boxes in boxes_list]
+            if sum(counts):
+                data = torch.cat(boxes_list).float().cpu().numpy()
+            else:
+                data = np.zeros((0, 6), dtype=np.float32)
+        finally:
+            if prepared is not None and self.device != "cpu":
+                # Copy and compute are done once results are on the host
+                torch.cuda.current_stream().synchronize()
+                self._host_pool.put(prepared[3])
+        xyxy = data[:, :4].tolist()
+        conf = data[:, 4].tolist()
+        cls = data[:, 5].astype(int).tolist()
 
-    def infer(self, image_paths):
-        # Ultralytics handles batching internally
-        results_raw = self.model(image_paths, verbose=False)
-        
         results = []
-        for i, res in enumerate(results_raw):
-            detections = []
-            for box in res.boxes:
-                detections.append({
-                    "cls": int(box.cls[0]),
-                    "conf": float(box.conf[0]),
-                    "xyxy": box.xyxy[0].tolist()
-                })
+        start = 0
+        for i, count in enumerate(counts):
+            end = start + count
+            detections = [
+                {"cls": c, "conf": p, "xyxy": b}
+                for c, p, b in zip(cls[start:end], conf[start:end], xyxy[start:end])
+            ]
+            start = end
 
             results.append({
                 "image_path": image_paths[i],
-                "detections": detections,
-                "original_result": res
+                "detections": detections
             })
         return results
 
 # ---------------------------------------------------------
 # WORKER THREAD
 # ---------------------------------------------------------
+def ack_messages(r, stream_name, msg_ids):
+    """Acknowledge processed messages for the group and drop them from the stream."""
+    r.xack(stream_name, GROUP_NAME, *msg_ids)
+    r.xdel(stream_name, *msg_ids)
+
+def ensure_group(r, stream_name):
+    """Create the workers' consumer group (starts at "0" = whole backlog, as before)."""
+    try:
+        r.xgroup_create(stream_name, GROUP_NAME, id="0", mkstream=True)
+    except redis.exceptions.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+def dispatch_loop(backends):
+    """
+    One multi-key XREADGROUP over the model_queue streams of every model in
+    this process; parsed batches go to each backend's in_queue. Entries stay
+    pending until the model's inference loop has saved their results.
+    """
+    r = get_redis_connection()
+    by_stream = {f"model_queue:{b.model_name}": b for b in backends}
+    for stream_name in by_stream:
+        ensure_group(r, stream_name)
+
+    # Per stream: drain this consumer's pending (unacked) entries first, then ">"
+    read_ids = {stream_name: "0" for stream_name in by_stream}
+    # COUNT applies per stream; the smallest bound keeps bundles within every model's limit
+    read_count = min(max(1, MAX_BUNDLE_IMAGES // b.config.get("batch_size", 1)) for b in backends)
+
+    while True:
+        try:
+            # Retry failed batches: re-drain the pending list of flagged models
+            # (bundles still in flight are re-read too; the upsert is idempotent)
+            for name, b in by_stream.items():
+                if b.redeliver.is_set():
+                    b.redeliver.clear()
+                    read_ids[name] = "0"
+
+            # Skip models that are still busy with earlier bundles
+            streams = {name: read_ids[name] for name, b in by_stream.items() if not b.in_queue.full()}
+            if not streams:
+                time.sleep(0.01)
+                continue
+
+            # Read several batches from all streams in one round-trip. While a
+            # busy model's stream is left out, block only briefly so it is read
+            # again soon after its queue frees up, even if the others are idle
+            block = 5000 if len(streams) == len(by_stream) else 50
+            messages = r.xreadgroup(GROUP_NAME, CONSUMER_NAME, streams, count=read_count, block=block)
+
+            for stream_name, entries in messages or []:
+                stream_name = stream_name.decode() if isinstance(stream_name, bytes) else stream_name
+                backend = by_stream[stream_name]
+                if not entries:
+                    read_ids[stream_name] = ">"   # pending backlog drained, switch to new entries
+                    continue
+                if read_ids[stream_name] != ">":
+                    read_ids[stream_name] = entries[-1][0]
+
+                # Bundle all messages into one inference batch
+                msg_ids = [msg_id for msg_id, _ in entries]
+                batch = []
+                for _, fields in entries:
+                    if fields:
+                        batch.extend(orjson.loads(fields[b"batch"]))
+
+                backend.log.info(f"📥 Batch received: {len(batch)} images ({len(msg_ids)} messages)")
+                backend.in_queue.put((msg_ids, batch))
+
+        except redis.exceptions.ConnectionError as e:
+            log.error(f"❌ Dispatcher lost Redis: {e}")
+            time.sleep(1)
+        except redis.exceptions.ResponseError as e:
+            log.error(f"❌ Dispatcher error: {e}")
+            if "NOGROUP" in str(e):
+                for stream_name in by_stream:
+                    ensure_group(r, stream_name)
+            time.sleep(1)
+        except Exception as e:
+            log.error(f"❌ Dispatcher error: {e}")
+            log.debug("Dispatcher traceback", exc_info=True)
+            time.sleep(1)
+
+def prefetch_loop(backend, r, stream_name, prefetch_q):
+    """Decode + preprocess dispatched batches ahead of inference (one thread per model)."""
+    disable_grad()
+    while True:
+        msg_ids, batch = backend.in_queue.get()
+        try:
+            # Decode (shared raw frame, else TurboJPEG/OpenCV), dropping unreadable frames
+            batch, images, letterboxed = load_images(batch, getattr(backend, "imgsz", None))
+            if not batch:
+                ack_messages(r, stream_name, msg_ids)
+                continue
+
+            # Letterbox + start the GPU upload while the previous batch is inferred
+            prepared = backend.preprocess(images, letterboxed)
+            prefetch_q.put((msg_ids, batch, images, prepared))
+
+        except redis.exceptions.ConnectionError as e:
+            backend.log.error(f"❌ Prefetch lost Redis: {e}")
+            time.sleep(1)
+        except Exception as e:
+            backend.log.error(f"❌ Prefetch error: {e}")
+            backend.log.debug("Prefetch traceback", exc_info=True)
+            time.sleep(1)
+
 def worker_loop(backend):
     """Function to run in a separate thread for each model."""
+    disable_grad()
     r = get_redis_connection()
-    pg_conn = get_pg_connection()
-    pg_cursor = pg_conn.cursor()
+    pg_conn, pg_cursor = None, None  # opened before the first DB write, reopened after failures
     
     stream_name = f"model_queue:{backend.model_name}"
-    last_id = "0-0"
+    prefetch_q = queue.Queue(maxsize=PREFETCH_DEPTH)
+    writer_pool = ThreadPoolExecutor(max_workers=4)  # annotated image writes
+    writer_slots = threading.BoundedSemaphore(MAX_PENDING_ANNOTATIONS)
+    threading.Thread(target=prefetch_loop, args=(backend, r, stream_name, prefetch_q), daemon=True).start()
     
-    print(f"[{backend.model_name}] 🚀 Worker thread started. Listening to {stream_name}")
+    backend.log.info(f"🚀 Worker thread started. Listening to {stream_name}")
 
     while True:
+        msg_ids, batch, images, prepared = prefetch_q.get()
         try:
-            # Read batch from Redis stream
-            messages = r.xread({stream_name: last_id}, block=5000, count=1)
-            if not messages:
-                continue
-
-            _, entries = messages[0]
-            msg_id, fields = entries[0]
-            last_id = msg_id
-
-            batch_json = fields[b"batch"].decode()
-            batch = json.loads(batch_json)
-
             image_paths = [item["frame_path"] for item in batch]
-            print(f"[{backend.model_name}] 📥 Batch received: {len(image_paths)} images")
 
             # Run Inference
-            results = backend.infer(image_paths)
+            results = backend.infer(images, image_paths, prepared)
 
 
-            # Save to PostgreSQL and disk
+            # Save to disk; DB rows are collected and written once per batch
+            detection_rows = {}   # (frame_id, model_id) -> row (deduplicated for ON CONFLICT)
+            fallback_rows = []
             for i, item in enumerate(results):
                 batch_item = batch[i]
                 rule_ids = batch_item.get("rule_ids", [])
+                payload = orjson.dumps(item["detections"])  # serialized once, sent as-is
 
                 # -----------------------------------------------------
                 # SAVE ANNOTATED IMAGE IF DETECTIONS EXIST
@@ -178,27 +985,35 @@ def worker_loop(backend):
                         timestamp_str = batch_item.get("timestamp")
 
                         if plant and site and camera and timestamp_str:
-                            ts = datetime.fromisoformat(timestamp_str)
-                            folder_time = ts.strftime("%Y_%m_%d_%H")
-                            
                             # /shared/detected_frames/plant/site/camera/2023_...
-                            save_dir = os.path.join(SHARED_DIR, "detected_frames", plant, site, camera, folder_time)
-                            os.makedirs(save_dir, exist_ok=True)
-
-                            original_filename = os.path.basename(item["image_path"])
-                            
-                            # Fix overlap: append model name
-                            name_part, ext_part = os.path.splitext(original_filename)
-                            new_filename = f"{name_part}_{backend.model_name}{ext_part}"
-                            
-                            save_path = os.path.join(save_dir, new_filename)
-
-                            # Plot (returns BGR numpy array compatible with cv2)
-                            plotted_img = item["original_result"].plot()
-                            cv2.imwrite(save_path, plotted_img)
-                            print(f"[{backend.model_name}] 📸 Saved detection: {save_path} (Rules: {rule_ids})")
-                    except Exception as e:
-                        print(f"[{backend.model_name}] ⚠️ Failed to save annotation: {e}")
+                            save_dir = backend.detection_save_dir(plant, site, camera, timestamp_str)
+
+                            # Fix overlap: append model name ("<dir>/<id>.jpg" → "<id>_<model>.jpg")
+                            image_path = item["image_path"]
+                            slash = image_path.rfind("/")
+                            dot = image_path.rfind(".")
+                            if dot <= slash:
+                                dot = len(image_path)
+                            new_filename = f"{image_path[slash + 1:dot]}_{backend.model_name}{image_path[dot:]}"
+
+                            save_path = f"{save_dir}/{new_filename}"
+
+                            # Draw + encode + write off the inference loop; the decoded
+                            # frame is not used again, so boxes are drawn on it directly
+                            # unless the frame cache shares it with other models
+                            img = images[i]
+                            if frame_cache is not None and batch_item.get("fanout", 1) > 1:
+                                img = img.copy()
+                            writer_slots.acquire()  # back-pressure when disk/encode falls behind
+                            try:
+                                future = writer_pool.submit(save_annotated, img, item["detections"], backend.model.names,
+                                                            save_path, backend.model_name, rule_ids)
+                            except Exception:
+                                writer_slots.release()
+                                raise
+                            future.add_done_callback(lambda _: writer_slots.release())
+                    except OSError as e:
+                        backend.log.warning(f"⚠️ Failed to save annotation: {e}")
                 
                 # -----------------------------------------------------
                 # DB SAVE
@@ -207,28 +1022,55 @@ def worker_loop(backend):
                 model_id = backend.config.get("model_id")
                 
                 if frame_db_id is not None and model_id is not None:
-                    pg_cursor.execute("""
-                        INSERT INTO model_detections (frame_id, model_id, detection)
-                        VALUES (%s, %s, %s)
-                        ON CONFLICT (frame_id, model_id) 
-                        DO UPDATE SET detection = EXCLUDED.detection, timestamp = NOW();
-                    """, (frame_db_id, model_id, Json(item["detections"])))
+                    detection_rows[(frame_db_id, model_id)] = (frame_db_id, model_id, payload)
                 else:
                     # Fallback to old table or log warning
-                    print(f"[{backend.model_name}] ⚠️ custom save skipped (missing IDs). frame_id={frame_db_id} model_id={model_id}")
-                    pg_cursor.execute("""
-                        INSERT INTO detection_results (image_path, detections)
-                        VALUES (%s, %s)
-                    """, (item["image_path"], Json(item["detections"])))
+                    backend.log.warning(f"⚠️ custom save skipped (missing IDs). frame_id={frame_db_id} model_id={model_id}")
+                    fallback_rows.append((item["image_path"], payload.decode()))
 
-            print(f"[{backend.model_name}] 💾 Saved {len(results)} results")
+            if pg_conn is None or pg_conn.closed:
+                pg_conn, pg_cursor = open_pg_session()
+            if detection_rows:
+                copy_detections(pg_cursor, detection_rows.values())
+            if fallback_rows:
+                execute_values(pg_cursor, """
+                    INSERT INTO detection_results (image_path, detections)
+                    VALUES %s
+                """, fallback_rows, template="(%s, %s::jsonb)", page_size=200)
+            pg_conn.commit()
 
-            # Delete message from Redis
-            r.xdel(stream_name, msg_id)
+            backend.log.info(f"💾 Saved {len(results)} results")
 
+            # Ack + delete messages from Redis
+            ack_messages(r, stream_name, msg_ids)
+
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # Connection-level failure (or the connect itself failed): the
+            # session and its prepared statements are gone; drop it so the
+            # next batch opens a fresh one. The batch's entries are still
+            # pending, so have the dispatcher re-read them.
+            backend.log.error(f"❌ Postgres connection lost: {e}")
+            if pg_conn is not None:
+                pg_conn.close()
+            pg_conn, pg_cursor = None, None
+            time.sleep(1)
+            backend.redeliver.set()
+        except redis.exceptions.ConnectionError as e:
+            # Results are committed but not acked: re-read the pending entries
+            # (re-saving them is harmless, the upsert is idempotent)
+            backend.log.error(f"❌ Redis connection lost: {e}")
+            time.sleep(1)
+            backend.redeliver.set()
         except Exception as e:
-            print(f"[{backend.model_name}] ❌ Error:", e)
-            traceback.print_exc()
+            # Not retried: the entries stay pending (unacked) until the
+            # worker restarts and drains its pending list from "0"
+            backend.log.error(f"❌ Error: {e}")
+            backend.log.debug("Worker traceback", exc_info=True)
+            try:
+                if pg_conn is not None and not pg_conn.closed:
+                    pg_conn.rollback()
+            except psycopg2.Error:
+                pass
             time.sleep(1)
 
 # ---------------------------------------------------------
@@ -239,53 +1081,89 @@ def load_config():
         with open(MODELS_CONFIG_PATH, "r") as f:
             return json.load(f)
     except Exception as e:
-        print(f"⚠️ Could not read {MODELS_CONFIG_PATH}: {e}")
+        log.warning(f"⚠️ Could not read {MODELS_CONFIG_PATH}: {e}")
         return {}
 
-def main():
-    print("🚀 Model Worker Manager Started")
-    if YOLO is None:
-        # raise ImportError("Ultralytics not installed")  
-        print("Ultralytics not installed")
-    # Wait for Redis/DB to be ready
-    time.sleep(5) 
-    
-    config = load_config()
-    threads = []
+def model_process(models, gpu=None):
+    """
+    Entry point of a worker process: build + load the backends for its share
+    of the models, then serve them from one dispatcher + a thread per model.
+    """
+    global frame_cache
+    setup_logging()
+    disable_grad()
+    if gpu is not None:
+        # Must be set before CUDA is initialised in this process
+        os.environ["CUDA_VISIBLE_DEVICES"] = gpu
+
+    backends = []
+    for model_name, model_cfg in models.items():
+        log.info(f"🔧 Initializing backend for: {model_name}" + (f" (GPU {gpu})" if gpu is not None else ""))
 
-    for model_name, model_cfg in config.items():
-        print(f"🔧 Initializing backend for: {model_name}")
-        
         # FACTORY LOGIC (Expand here for Triton, etc.)
         # For now, we assume everything is YOLO unless specified otherwise
         backend_type = model_cfg.get("type", "yolo")
-        
+
         try:
             if backend_type == "yolo":
                 backend = YOLOBackend(model_name, model_cfg)
             else:
-                print(f"⚠️ Unknown backend type '{backend_type}' for {model_name}. Skipping.")
-                continue               
+                log.warning(f"⚠️ Unknown backend type '{backend_type}' for {model_name}. Skipping.")
+                continue
             # Load model (this might fail if file is missing)
             backend.load()
-            
-            # Start Thread
-            t = threading.Thread(target=worker_loop, args=(backend,), daemon=True)
-            t.start()
-            threads.append(t)
-            
+            backends.append(backend)
         except Exception as e:
-            print(f"⚠️ FAILED to start worker for {model_name}: {e}")
-            print(f"   -> This model will NOT process frames.")
+            log.error(f"⚠️ FAILED to start worker for {model_name}: {e} -> This model will NOT process frames.")
             continue
 
-    if not threads:
-        print("❌ No workers started. Exiting...")
+    if not backends:
         return
 
-    # Keep main thread alive
-    while True:
+    if len(backends) > 1 and FRAME_CACHE_SIZE > 0:
+        frame_cache = FrameCache(FRAME_CACHE_SIZE)
+
+    threading.Thread(target=dispatch_loop, args=(backends,), daemon=True).start()
+    threads = [threading.Thread(target=worker_loop, args=(backend,)) for backend in backends]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+def main():
+    setup_logging()
+    log.info("🚀 Model Worker Manager Started")
+    if YOLO is None:
+        # raise ImportError("Ultralytics not installed")  
+        log.warning("Ultralytics not installed")
+    # Wait for Redis/DB to be ready
+    time.sleep(5) 
+    
+    config = load_config()
+
+    # Shard models round-robin over the worker processes
+    items = list(config.items())
+    n_procs = min(WORKER_PROCESSES or len(items), len(items))
+    shards = [dict(items[i::n_procs]) for i in range(n_procs)]
+
+    # "spawn": children must not inherit a forked CUDA context
+    ctx = mp.get_context("spawn")
+    processes = []
+    for i, models in enumerate(shards):
+        gpu = GPU_DEVICES[i % len(GPU_DEVICES)] if GPU_DEVICES else None
+        p = ctx.Process(target=model_process, args=(models, gpu),
+                        name=f"model_worker:{','.join(models)}", daemon=True)
+        p.start()
+        processes.append(p)
+
+    if not processes:
+        log.error("❌ No workers started. Exiting...")
+        return
+
+    # Keep main process alive while any worker process is running
+    while any(p.is_alive() for p in processes):
         time.sleep(1)
+    log.error("❌ All model workers exited. Exiting...")
 
 if __name__ == "__main__":
     main()